@@ -1,20 +1,24 @@
 import asyncio
 import json
 import os
+import threading
+import uuid
+from contextlib import asynccontextmanager
 from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Optional
 
 from dotenv import load_dotenv
-from fastapi import Depends, FastAPI
+from fastapi import Depends, FastAPI, Header
 from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.memory import MemorySaver
 
 from .config import AppConfig, load_config
 from .orchestrator import build_graph
 from .schemas import ChatRequest
-from .streaming import stream_graph_events
+from .streaming import coalesce_frames, gzip_sse, stream_graph_events, with_keepalive
 
 # Load environment variables
 load_dotenv()
@@ -24,8 +28,26 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 STATIC_DIR = BASE_DIR / "static"
 CONFIG_PATH = BASE_DIR / "config.yaml"
 
+# Keep proxies (e.g. nginx) from buffering or caching the event stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Compiles the default workflow at startup so the first /chat request
+    doesn't pay for the graph build. A failure here (e.g. missing config or
+    API key) is logged and left for the first request to report.
+    """
+    try:
+        await asyncio.to_thread(get_workflow, get_config())
+    except Exception as e:
+        print(f"Workflow preload skipped: {e}")
+    yield
+
+
 # Initialize App
-app = FastAPI(title="AI Troubleshooting Agent")
+app = FastAPI(title="AI Troubleshooting Agent", lifespan=lifespan)
 
 # Mount Static Files
 if not STATIC_DIR.exists():
@@ -60,16 +82,49 @@ def get_current_config(config: AppConfig = Depends(get_config)):
 
 
 # Global checkpointer for persistence
-from langgraph.checkpoint.memory import MemorySaver
 checkpointer = MemorySaver()
 
+# Compiled workflows keyed by the JSON of the (possibly overridden) config.
+# Building a graph creates LLM clients and compiles the graph, so it is done
+# once per distinct config instead of once per request.
+WORKFLOW_CACHE_SIZE = 8
+_workflow_cache: Dict[str, Any] = {}
+_workflow_lock = threading.Lock()
+
+
+def get_workflow(config: AppConfig) -> Any:
+    """
+    Returns the compiled workflow for this config, building it on first use.
+    The oldest entry is evicted once WORKFLOW_CACHE_SIZE configs are cached.
+    """
+    key = config.model_dump_json()
+    workflow = _workflow_cache.get(key)
+    if workflow is None:
+        with _workflow_lock:
+            workflow = _workflow_cache.get(key)
+            if workflow is None:
+                if len(_workflow_cache) >= WORKFLOW_CACHE_SIZE:
+                    _workflow_cache.pop(next(iter(_workflow_cache)))
+                workflow = build_graph(config, checkpointer=checkpointer)
+                _workflow_cache[key] = workflow
+    return workflow
+
+
+def clear_workflow_cache() -> None:
+    """Drops all cached workflows (e.g. between tests that patch build_graph)."""
+    with _workflow_lock:
+        _workflow_cache.clear()
+
 @app.post("/chat")
-async def chat(request: ChatRequest, config: AppConfig = Depends(get_config)):
+async def chat(
+    request: ChatRequest,
+    config: AppConfig = Depends(get_config),
+    accept_encoding: Optional[str] = Header(None)
+):
     """
     Process a chat message through the LangGraph orchestrator with streaming.
+    The stream is gzip-encoded when the client accepts it.
     """
-    import uuid
-
     # Check for overrides
     updated_kwargs = {}
     if request.model_name:
@@ -80,30 +135,44 @@ async def chat(request: ChatRequest, config: AppConfig = Depends(get_config)):
     if updated_kwargs:
         config = config.model_copy(update=updated_kwargs)
 
-    # Use global checkpointer so state is persisted across builds (if we cached graph)
-    # But current design rebuilds graph on config change.
-    # We pass the checkpointer to valid it's used.
-    app_workflow = build_graph(config, checkpointer=checkpointer)
+    # Reuses the compiled graph (and its global checkpointer) for this config.
+    # A miss builds it on a worker thread, as the lifespan preload does, so the
+    # build never blocks the event loop (and with it every other open stream)
+    app_workflow = _workflow_cache.get(config.model_dump_json())
+    if app_workflow is None:
+        app_workflow = await asyncio.to_thread(get_workflow, config)
 
     # Generate or reuse thread_id (for now, simple random one for every new chat request,
     # unless we want to support conversation history from frontend eventually)
     # Ideally frontend should send a conversation/thread ID. Use a random one for now.
     thread_id = str(uuid.uuid4())
 
-    inputs = {"messages": [HumanMessage(content=request.message)]}
+    # Prior turns (already pruned by the client) precede the new message
+    history = [
+        HumanMessage(content=m.content) if m.role == "user" else AIMessage(content=m.content)
+        for m in request.history
+    ]
+    inputs = {"messages": history + [HumanMessage(content=request.message)]}
 
     # Pass thread_id to the runner
     run_config = {"configurable": {"thread_id": thread_id}}
 
+    events = with_keepalive(coalesce_frames(stream_graph_events(app_workflow, inputs, run_config)))
+    if accept_encoding and "gzip" in accept_encoding:
+        return StreamingResponse(
+            gzip_sse(events),
+            media_type="text/event-stream",
+            headers={**SSE_HEADERS, "Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+        )
+
     return StreamingResponse(
-        stream_graph_events(app_workflow, inputs, run_config),
-        media_type="text/event-stream"
+        events,
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
     )
 
 
 if __name__ == "__main__":
-    import uvicorn
-
     # Verify config on startup
     try:
         config = load_config(str(CONFIG_PATH))
@@ -112,4 +181,21 @@ if __name__ == "__main__":
         print(f"Failed to load config: {e}")
         exit(1)
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if os.getenv("ASGI_SERVER", "uvicorn") == "hypercorn":
+        # Optional HTTP/2 server (pip install hypercorn). Browsers only
+        # negotiate h2 over TLS, so pass SSL_CERTFILE / SSL_KEYFILE for that.
+        from hypercorn.asyncio import serve
+        from hypercorn.config import Config as HypercornConfig
+
+        server_config = HypercornConfig()
+        server_config.bind = ["0.0.0.0:8000"]
+        server_config.alpn_protocols = ["h2", "http/1.1"]
+        server_config.certfile = os.getenv("SSL_CERTFILE")
+        server_config.keyfile = os.getenv("SSL_KEYFILE")
+        # hypercorn's stubs type the app as its own ASGI protocol, which FastAPI
+        # satisfies at runtime but not structurally
+        asyncio.run(serve(app, server_config))  # type: ignore[arg-type]
+    else:
+        import uvicorn
+
+        uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -34,6 +34,8 @@ def get_orchestrator_node(config: AppConfig):
     Factory function to create the orchestrator node with the given configuration.
     """
     llm = get_llm(config.orchestrator_provider, config.orchestrator_model, temperature=0)
+    # Bind the structured-output schema once per node rather than on every invocation
+    structured_llm = llm.with_structured_output(OrchestratorDecision)
 
     def orchestrator_node(state: AgentState):
         messages = state["messages"]
@@ -61,8 +63,6 @@ def get_orchestrator_node(config: AppConfig):
             f"If standard diagnostics are needed, route to 'aci' and 'palo_alto'.\n"
         )
 
-        structured_llm = llm.with_structured_output(OrchestratorDecision)
-
         try:
             decision = structured_llm.invoke([SystemMessage(content=system_message)] + list(messages))  # type: ignore
         except Exception as e:
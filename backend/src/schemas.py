@@ -1,7 +1,12 @@
-from typing import Optional
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
+
+class ChatMessage(BaseModel):
+    role: Literal["user", "assistant"]
+    content: str
 
 class ChatRequest(BaseModel):
     message: str
     model_name: Optional[str] = None
     model_provider: Optional[str] = None
+    history: List[ChatMessage] = Field(default_factory=list)
@@ -1,7 +1,21 @@
+import asyncio
 import json
-from typing import Any, AsyncGenerator, Dict, Optional
+import zlib
+from typing import Any, AsyncGenerator, AsyncIterable, Dict, Optional
 from datetime import datetime, timezone
 
+try:
+    import orjson
+
+    def json_dumps(obj: Any) -> str:
+        # orjson serializes to bytes in C; decoded once for the str SSE frame
+        return orjson.dumps(obj).decode("utf-8")
+except ImportError:  # Optional dependency; fall back to the stdlib encoder
+    json_dumps = json.dumps
+
+# SSE comment frame sent while the graph is quiet; clients ignore comments
+KEEPALIVE_FRAME = ": ping\n\n"
+
 
 async def stream_graph_events(
     workflow: Any,
@@ -70,11 +84,12 @@ async def stream_graph_events(
                 thought_data["output_keys"] = list(output.keys())
 
         # Emit as SSE thought event
-        sse_data = json.dumps(thought_data)
-        yield f"event: thought\ndata: {sse_data}\n\n"
+        frame = f"event: thought\ndata: {json_dumps(thought_data)}\n\n"
 
         # --- Legacy state update handling for backwards compatibility ---
-        # Also emit triage_report if present in output
+        # Also emit triage_report / routing if present in output. These are
+        # appended to the thought frame so the whole transition goes out as a
+        # single chunk instead of one write per SSE event.
         if event_type == "on_chain_end":
             output = data.get("output", {})
             if isinstance(output, dict):
@@ -89,10 +104,102 @@ async def stream_graph_events(
                     else:
                         report_data = report  # assume dict if not pydantic
 
-                    report_json = json.dumps(report_data)
-                    yield f"event: triage_report\ndata: {report_json}\n\n"
+                    frame += f"event: triage_report\ndata: {json_dumps(report_data)}\n\n"
 
                 # Handle routing info for debugging
                 if "next_node" in output:
-                    routing_data = json.dumps({"routing": output["next_node"]})
-                    yield f"event: routing\ndata: {routing_data}\n\n"
+                    routing_data = json_dumps({"routing": output["next_node"]})
+                    frame += f"event: routing\ndata: {routing_data}\n\n"
+
+        yield frame
+
+
+async def with_keepalive(
+    frames: AsyncIterable[str],
+    interval: float = 15.0
+) -> AsyncGenerator[str, None]:
+    """
+    Passes frames through, emitting KEEPALIVE_FRAME whenever `interval`
+    seconds pass without one, so proxies and client read timeouts don't cut
+    the stream during long LLM or tool calls.
+    """
+    iterator = frames.__aiter__()
+    # The pending read is awaited with a timeout but never cancelled by it,
+    # so the wrapped generator is not interrupted mid-step
+    next_frame = asyncio.ensure_future(iterator.__anext__())
+    try:
+        while True:
+            done, _ = await asyncio.wait({next_frame}, timeout=interval)
+            if not done:
+                yield KEEPALIVE_FRAME
+                continue
+            try:
+                frame = next_frame.result()
+            except StopAsyncIteration:
+                return
+            yield frame
+            next_frame = asyncio.ensure_future(iterator.__anext__())
+    finally:
+        next_frame.cancel()
+
+
+async def coalesce_frames(
+    frames: AsyncIterable[str],
+    window: float = 0.03,
+    max_frames: int = 16
+) -> AsyncGenerator[str, None]:
+    """
+    Joins frames that arrive within `window` seconds of the first pending one
+    into a single chunk (at most `max_frames` per chunk). Bursts of graph
+    events then go out as one write, and the client renders once per burst.
+    Frames stay complete SSE events, so clients parse the chunk unchanged.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = frames.__aiter__()
+    pending: list[str] = []
+    deadline = 0.0
+    next_frame = asyncio.ensure_future(iterator.__anext__())
+    try:
+        while True:
+            timeout = max(0.0, deadline - loop.time()) if pending else None
+            done, _ = await asyncio.wait({next_frame}, timeout=timeout)
+            if not done:
+                # Window elapsed with no new frame: flush what we have
+                yield "".join(pending)
+                pending.clear()
+                continue
+            try:
+                frame = next_frame.result()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                # Deliver what arrived before the failure, then propagate it
+                if pending:
+                    yield "".join(pending)
+                raise
+            next_frame = asyncio.ensure_future(iterator.__anext__())
+
+            if not pending:
+                deadline = loop.time() + window
+            pending.append(frame)
+            if len(pending) >= max_frames:
+                yield "".join(pending)
+                pending.clear()
+
+        if pending:
+            yield "".join(pending)
+    finally:
+        next_frame.cancel()
+
+
+async def gzip_sse(frames: AsyncIterable[str]) -> AsyncGenerator[bytes, None]:
+    """
+    Gzip-encodes an SSE stream frame by frame.
+
+    Each frame is followed by a sync flush so the client can decode it as soon
+    as it arrives, instead of waiting for the compressor's window to fill.
+    """
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    async for frame in frames:
+        yield compressor.compress(frame.encode("utf-8")) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
@@ -2,6 +2,7 @@ import pytest
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.language_models import BaseChatModel
 from langchain_core.outputs import ChatResult, ChatGeneration
+import backend.src.sub_agents.aci as aci_module
 from backend.src.sub_agents.aci import get_aci_agent_node, aci_diag
 from backend.src.config import AppConfig
 from unittest.mock import MagicMock, patch
@@ -19,9 +20,15 @@ def test_aci_diag_tool():
     result = aci_diag.invoke({"target": "Flagship-Switch-01"})
     assert "Health Score=95" in result
 
+# Constant input message, shared across tests
+_MSG_LEAF_DIAG = HumanMessage(content="Check diagnostics for Leaf-101")
+
+# Canned result built once; _generate hands back the same instance every call
+_FAKE_RESULT = ChatResult(generations=[ChatGeneration(message=AIMessage(content="Diagnostic completed"))])
+
 class FakeChatModel(BaseChatModel):
     def _generate(self, messages, stop=None, run_manager=None, **kwargs):
-        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="Diagnostic completed"))])
+        return _FAKE_RESULT
 
     def bind_tools(self, tools, **kwargs):
         return self
@@ -30,22 +37,21 @@ class FakeChatModel(BaseChatModel):
     def _llm_type(self):
         return "fake"
 
-def test_aci_agent_node_process(mock_config):
+def test_aci_agent_node_process(mock_config, monkeypatch):
     # Mock get_llm to avoid missing API key error and return FakeChatModel
-    with patch("backend.src.sub_agents.aci.get_llm") as mock_get_llm:
-        mock_get_llm.return_value = FakeChatModel()
+    monkeypatch.setattr(aci_module, "get_llm", lambda *args, **kwargs: FakeChatModel())
 
-        node = get_aci_agent_node(mock_config)
+    node = get_aci_agent_node(mock_config)
 
-        # Simulate a state passed from orchestrator
-        state = {
-            "messages": [HumanMessage(content="Check diagnostics for Leaf-101")],
-            "next_node": "network_specialist"
-        }
+    # Simulate a state passed from orchestrator
+    state = {
+        "messages": [_MSG_LEAF_DIAG],
+        "next_node": "network_specialist"
+    }
 
-        result = node(state)
-        assert result.summary == "Diagnostic completed"
-        assert result.status == "SUCCESS"
+    result = node(state)
+    assert result.summary == "Diagnostic completed"
+    assert result.status == "SUCCESS"
 
 
 
@@ -16,6 +16,13 @@ from backend.src.sub_agents.palo_alto import get_palo_alto_agent_node
 from backend.src.orchestrator import get_orchestrator_node
 from backend.src.sub_agents.triage import get_triage_node
 
+# Constant input messages, shared across tests
+_MSG_QUERY = HumanMessage(content="Test query")
+_MSG_GO = HumanMessage(content="Go")
+
+# Canned agent transcript returned by the mocked react agent
+_AGENT_TRANSCRIPT = [HumanMessage(content="task"), AIMessage(content="Final Answer")]
+
 class MockConfig(AppConfig):
     orchestrator_provider: str = "openai"
     orchestrator_model: str = "gpt-3.5-turbo"
@@ -99,7 +106,7 @@ def test_orchestrator_initialization_and_run(mock_get_llm, mock_load_prompt, moc
     node = get_orchestrator_node(mock_config)
 
     # Run Node
-    state = {"messages": [HumanMessage(content="Test query")], "incident_data": {"source_ip": "1.1.1.1", "destination_ip": "2.2.2.2"}}
+    state = {"messages": [_MSG_QUERY], "incident_data": {"source_ip": "1.1.1.1", "destination_ip": "2.2.2.2"}}
     result = node(state)
 
     # Assertions
@@ -150,12 +157,7 @@ def test_agent_execution_wrapper(mock_load, mock_get_llm, mock_create_agent, moc
     # Setup Mock Agent
     mock_agent_instance = MagicMock()
     # Invoke returns a dict with 'messages'
-    mock_agent_instance.invoke.return_value = {
-        "messages": [
-            HumanMessage(content="task"),
-            AIMessage(content="Final Answer")
-        ]
-    }
+    mock_agent_instance.invoke.return_value = {"messages": _AGENT_TRANSCRIPT}
     mock_create_agent.return_value = mock_agent_instance
     mock_get_llm.return_value = mock_llm
 
@@ -163,7 +165,7 @@ def test_agent_execution_wrapper(mock_load, mock_get_llm, mock_create_agent, moc
     node = get_aci_agent_node(mock_config)
 
     # Execute
-    state = {"messages": [HumanMessage(content="Go")]}
+    state = {"messages": [_MSG_GO]}
     result = node(state)
 
     # Verify Result
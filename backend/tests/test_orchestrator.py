@@ -1,30 +1,64 @@
 import pytest
 from typing import Dict, Any
-from unittest.mock import MagicMock, patch
-from backend.src.orchestrator import get_orchestrator_node, AgentState
+from unittest.mock import patch
+from backend.src.orchestrator import get_orchestrator_node
 from backend.src.config import AppConfig
-from backend.src.models import OrchestratorDecision, SubAgentResult, AgentStatus
+from backend.src.models import OrchestratorDecision
 
-# Mock AppConfig
-@pytest.fixture
+# AppConfig with known-valid values (read-only in these tests, so built once
+# per module); model_construct skips Pydantic validation
+@pytest.fixture(scope="module")
 def mock_config():
-    config = MagicMock(spec=AppConfig)
-    config.orchestrator_provider = "openai"
-    config.orchestrator_model = "gpt-4o"
-    config.system_prompt = "You are a helper."
-    config.sub_agents = []
-    return config
+    return AppConfig.model_construct(
+        orchestrator_provider="openai",
+        orchestrator_model="gpt-4o",
+        system_prompt="You are a helper.",
+        sub_agents=[]
+    )
+
+class StubLLM:
+    """
+    Minimal chat-model stand-in: with_structured_output returns itself and
+    invoke returns the canned response (or raises it if it is an exception).
+    """
+    def __init__(self, response):
+        self.response = response
+        self.calls = 0
+
+    def with_structured_output(self, schema):
+        return self
+
+    def invoke(self, *args, **kwargs):
+        self.calls += 1
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+# Shared stub: the orchestrator binds its LLM at construction, so tests
+# swap the stub's response rather than rebuilding the node
+_shared_stub = StubLLM(None)
+
+# Mock LLM Factory: patched once for the module
+@pytest.fixture(scope="module")
+def _get_llm_patch():
+    patcher = patch("backend.src.orchestrator.get_llm")
+    yield patcher.start()
+    patcher.stop()
+
+@pytest.fixture(scope="module")
+def orchestrator(mock_config, _get_llm_patch):
+    _get_llm_patch.return_value = _shared_stub
+    return get_orchestrator_node(mock_config)
 
-# Mock LLM Factory
 @pytest.fixture
-def mock_get_llm():
-    with patch("backend.src.orchestrator.get_llm") as mock:
-        yield mock
+def stub_llm():
+    _shared_stub.response = None
+    _shared_stub.calls = 0
+    return _shared_stub
 
-def test_missing_ips_routes_to_infoblox(mock_config, mock_get_llm):
+def test_missing_ips_routes_to_infoblox(orchestrator, stub_llm):
     """Test that missing IPs route to infoblox deterministically."""
     # Setup
-    orchestrator = get_orchestrator_node(mock_config)
     state: Dict[str, Any] = {
         "messages": [],
         "incident_data": {}, # Empty data
@@ -39,25 +73,22 @@ def test_missing_ips_routes_to_infoblox(mock_config, mock_get_llm):
     assert result["next_node"] == "infoblox"
     assert result["decision"].next_steps == ["infoblox"]
     assert "Missing source_ip" in result["decision"].reasoning
-
-def test_present_ips_routes_to_sub_agents(mock_config, mock_get_llm):
-    """Test that present IPs invoke LLM and route to sub_agents."""
+    assert stub_llm.calls == 0
+
+@pytest.mark.parametrize("llm_response, expected_next_steps, reasoning_fragment", [
+    (
+        OrchestratorDecision(next_steps=["sub_agents"], reasoning="Data looks good, checking firewalls."),
+        ["sub_agents"],
+        "checking firewalls",
+    ),
+    (Exception("API Error"), ["aci", "palo_alto"], "LLM parsing failed"),
+], ids=["llm_decision", "llm_failure_fallback"])
+def test_present_ips_invoke_llm(orchestrator, stub_llm, llm_response, expected_next_steps, reasoning_fragment):
+    """Test that present IPs invoke the LLM, falling back to aci and palo_alto if it fails."""
     # Setup Mocks
-    mock_llm_instance = MagicMock()
-    mock_get_llm.return_value = mock_llm_instance
-
-    # Mock the structured output
-    mock_structured_llm = MagicMock()
-    mock_llm_instance.with_structured_output.return_value = mock_structured_llm
-
-    expected_decision = OrchestratorDecision(
-        next_steps=["sub_agents"],
-        reasoning="Data looks good, checking firewalls."
-    )
-    mock_structured_llm.invoke.return_value = expected_decision
+    stub_llm.response = llm_response
 
     # Setup State
-    orchestrator = get_orchestrator_node(mock_config)
     state: Dict[str, Any] = {
         "messages": [],
         "incident_data": {
@@ -71,43 +102,10 @@ def test_present_ips_routes_to_sub_agents(mock_config, mock_get_llm):
     # Execute
     result = orchestrator(state)
 
-    # Verify
-    # Verify
-    # assert result["next_node"] == "sub_agents" # Node no longer returns next_node, router handles it
-    assert result["decision"] == expected_decision
-    assert result["decision"] == expected_decision
-    # Ensure LLM was called (via with_structured_output)
-    mock_structured_llm.invoke.assert_called_once()
-
-def test_llm_failure_fallback(mock_config, mock_get_llm):
-    """Test that if LLM fails, we fallback to sub_agents."""
-    # Setup Mocks
-    mock_llm_instance = MagicMock()
-    mock_get_llm.return_value = mock_llm_instance
-
-    mock_structured_llm = MagicMock()
-    mock_llm_instance.with_structured_output.return_value = mock_structured_llm
-
-    # Simulate Error
-    mock_structured_llm.invoke.side_effect = Exception("API Error")
-
-    # Setup State
-    orchestrator = get_orchestrator_node(mock_config)
-    state: Dict[str, Any] = {
-        "messages": [],
-        "incident_data": {
-            "source_ip": "1.1.1.1",
-            "destination_ip": "2.2.2.2"
-        },
-        "next_node": "",
-        "decision": None
-    }
-
-    # Execute
-    result = orchestrator(state)
-
-    # Verify
-    # Verify
+    # Verify (the node no longer returns next_node, the router handles it)
     assert "triage" not in result # Should not be triage handling validation
-    assert "LLM parsing failed" in result["decision"].reasoning
-    assert result["decision"].next_steps == ["aci", "palo_alto"]
+    assert "next_node" not in result
+    assert result["decision"].next_steps == expected_next_steps
+    assert reasoning_fragment in result["decision"].reasoning
+    # Ensure LLM was called (via with_structured_output)
+    assert stub_llm.calls == 1
@@ -1,28 +1,29 @@
-import requests
-import json
+import asyncio
 import sys
 
-def verify_streaming():
+import httpx
+
+async def verify_streaming():
     url = "http://localhost:8000/chat"
     payload = {"message": "Troubleshoot ACI tenant ABC"}
 
     print(f"Connecting to {url}...")
     try:
-        with requests.post(url, json=payload, stream=True) as response:
-            if response.status_code != 200:
-                print(f"Error: Status code {response.status_code}")
-                print(response.text)
-                return False
-
-            print("Connected. Listening for events...")
-            buffer = ""
-            for chunk in response.iter_content(chunk_size=1024):
-                if chunk:
-                    text = chunk.decode('utf-8')
-                    buffer += text
-
-                    while "\n\n" in buffer:
-                        event_str, buffer = buffer.split("\n\n", 1)
+        async with httpx.AsyncClient(timeout=None) as client:
+            async with client.stream("POST", url, json=payload) as response:
+                if response.status_code != 200:
+                    print(f"Error: Status code {response.status_code}")
+                    print((await response.aread()).decode("utf-8", errors="replace"))
+                    return False
+
+                print("Connected. Listening for events...")
+                buffer = bytearray()
+                async for chunk in response.aiter_bytes():
+                    buffer += chunk
+
+                    while (i := buffer.find(b"\n\n")) != -1:
+                        event_str = bytes(buffer[:i]).decode("utf-8")
+                        del buffer[:i + 2]
                         print(f"--- Event Received ---\n{event_str}\n----------------------")
 
                         if "event: thought" in event_str:
@@ -33,5 +34,13 @@ def verify_streaming():
 
     return True
 
+async def main(probes: int = 1):
+    """Runs `probes` concurrent verifications against the backend."""
+    results = await asyncio.gather(*[verify_streaming() for _ in range(probes)])
+    return all(results)
+
 if __name__ == "__main__":
-    verify_streaming()
+    # Optional first argument: number of concurrent probes (default 1)
+    probes = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    # Non-zero exit status if any probe failed, so CI steps can gate on it
+    sys.exit(0 if asyncio.run(main(probes)) else 1)
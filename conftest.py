@@ -0,0 +1,32 @@
+import sys
+
+import pytest
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--run-integration",
+        action="store_true",
+        default=False,
+        help="run tests marked 'integration' (full graph compile and invoke)",
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip integration-marked tests unless --run-integration is given."""
+    if config.getoption("--run-integration"):
+        return
+    skip_integration = pytest.mark.skip(reason="use --run-integration to run")
+    for item in items:
+        # Match the marker itself; keywords would also match names such as test_api_integration.py
+        if item.get_closest_marker("integration") is not None:
+            item.add_marker(skip_integration)
+
+
+@pytest.fixture(autouse=True)
+def _clear_workflow_cache():
+    """Start every test without cached workflows, so patched build_graph/get_llm take effect."""
+    main = sys.modules.get("backend.src.main")
+    if main is not None:
+        main.clear_workflow_cache()
+    yield
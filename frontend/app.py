@@ -1,7 +1,11 @@
 import streamlit as st
 import requests
-import json
+import io
 import os
+import queue
+import threading
+import time
+from requests.adapters import HTTPAdapter
 import logic
 from datetime import datetime
 
@@ -9,6 +13,14 @@ from datetime import datetime
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 print(f"Backend URL configured: {BACKEND_URL}")
 API_CHAT_URL = f"{BACKEND_URL}/chat"
+# Read size for the SSE stream; large reads keep per-chunk Python overhead low
+SSE_CHUNK_SIZE = int(os.getenv("SSE_CHUNK_SIZE", "65536"))
+# Streamed text is re-rendered at most every RENDER_INTERVAL seconds,
+# or sooner once RENDER_MAX_PENDING_CHARS of new text have piled up
+RENDER_INTERVAL = 0.05
+RENDER_MAX_PENDING_CHARS = 256
+# Only the newest CHAT_RENDER_WINDOW messages are drawn unless older ones are requested
+CHAT_RENDER_WINDOW = 40
 
 st.set_page_config(
     page_title="Ralph - AI Troubleshooting Agent",
@@ -17,13 +29,23 @@ st.set_page_config(
 )
 
 # --- Load Custom CSS ---
+@st.cache_resource(show_spinner=False)
+def read_css(path: str, mtime: float) -> str:
+    """
+    Reads the stylesheet once per process; keyed on mtime so edits are picked up.
+    cache_resource hands back the same immutable string instead of unpickling a copy.
+    """
+    with open(path) as f:
+        return f.read()
+
 def load_css():
     css_path = os.path.join(os.path.dirname(__file__), "style.css")
     try:
-        with open(css_path) as f:
-            st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
+        css = read_css(css_path, os.path.getmtime(css_path))
     except FileNotFoundError:
         st.warning(f"style.css not found at {css_path}")
+        return
+    st.markdown(f'<style>{css}</style>', unsafe_allow_html=True)
 
 load_css()
 
@@ -32,53 +54,135 @@ st.title("🤖 Ralph - AI Troubleshooting Agent")
 # --- Session State Initialization ---
 logic.initialize_session_state(st.session_state)
 
-def get_agent_display_name(node_name: str) -> str:
-    """Convert raw node name to properly formatted display label."""
-    return logic.get_agent_display_name(node_name)
-
 # --- Helper Functions ---
+def get_backend_session() -> requests.Session:
+    """
+    Returns the user's pooled HTTP session.
+    Stored in session_state so keep-alive connections survive Streamlit reruns.
+    """
+    if "_backend_session" not in st.session_state:
+        session = requests.Session()
+        # No retries: a replayed /chat POST would run the whole graph twice
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Connection"] = "keep-alive"
+        st.session_state._backend_session = session
+    return st.session_state._backend_session
+
+@st.cache_data(ttl=10, show_spinner=False)
 def check_backend_health():
-    """Checks if the backend is reachable."""
+    """
+    Checks if the backend is reachable (over the pooled session).
+    Cached for 10s so reruns don't each pay for a blocking probe.
+    """
     try:
-        response = requests.get(f"{BACKEND_URL}/health", timeout=2)
+        response = get_backend_session().get(f"{BACKEND_URL}/health", timeout=2)
         return response.status_code == 200
     except requests.exceptions.RequestException:
         return False
 
+# Marks the end of the queued SSE events for one chat turn
+STREAM_END = object()
+
+def stream_chat_events(session: requests.Session, body: bytes, events: queue.SimpleQueue) -> None:
+    """
+    Producer for a chat turn, run on a background thread.
+    Reads the SSE stream and queues decoded (event_type, data) pairs so the
+    socket read never waits on Streamlit rendering. Must not call st.*.
+    Failures are queued as ("error", message); STREAM_END is always queued last.
+    """
+    try:
+        with session.post(
+            API_CHAT_URL,
+            data=body,
+            # The backend gzips the SSE stream; urllib3 decodes it incrementally
+            headers={
+                "Content-Type": "application/json",
+                "Accept": "text/event-stream",
+                "Accept-Encoding": "gzip"
+            },
+            stream=True,
+            timeout=(5, 120)  # (connect, read between chunks)
+        ) as response:
+            if response.status_code != 200:
+                events.put(("error", f"Error: {response.status_code} - {response.text}"))
+                return
+
+            parser = logic.SSEParser()
+            # Read the raw urllib3 stream: skips requests' iter_content wrapper
+            for chunk in response.raw.stream(SSE_CHUNK_SIZE, decode_content=True):
+                for event_type, data_bytes in parser.feed(chunk):
+                    try:
+                        events.put((event_type, logic.json_loads(data_bytes)))
+                    except ValueError:
+                        pass # formatting error or keepalive (JSONDecodeError is a ValueError)
+    except Exception as e:
+        events.put(("error", f"Connection failed: {e}"))
+    finally:
+        events.put(STREAM_END)
+
+@st.fragment
+def render_connection_status() -> None:
+    """
+    Backend status block. Runs as a fragment so Refresh Status reruns only
+    this block, not the whole app.
+    """
+    st.header("Connection Status")
+    if st.button("Refresh Status"):
+        # Force a fresh probe instead of the cached result
+        check_backend_health.clear()
+
+    if check_backend_health():
+        st.success("🟢 Backend Online")
+    else:
+        st.error("🔴 Backend Offline")
+
+def mark_agent_read(agent_name: str) -> None:
+    """Mark Read callback: runs before the click's rerun, so the tab label updates in that same run."""
+    st.session_state.agent_tabs[agent_name]["has_new_activity"] = False
+
+def remember_model_choice(provider: str) -> None:
+    """Model selectbox callback: records the pick in model_choice so it survives switching providers."""
+    st.session_state.model_choice[provider] = st.session_state[f"model_name_{provider}"]
+
 # --- Sidebar ---
 with st.sidebar:
     st.header("Settings")
 
-    # Model Provider Selection
+    # Model Provider Selection (bound to session_state via key)
     provider = st.radio(
         "Model Provider",
-        ["OpenAI", "Gemini"],
-        index=1
+        logic.PROVIDER_OPTIONS,
+        index=logic.PROVIDER_INDEX[logic.DEFAULT_PROVIDER],
+        key="model_provider"
     )
 
-    # Model Name Selection based on Provider
-    if provider == "OpenAI":
-        model_options = ["gpt-4o", "gpt-4-turbo", "gpt-3.5-turbo"]
-    else:
-        model_options = ["gemini-2.5-flash"]
-
+    # Model Name Selection based on Provider. The widget state of the other
+    # provider's selectbox is dropped while it isn't rendered, so the last pick
+    # per provider is restored from model_choice via index
+    presets = logic.MODEL_PRESETS[provider]
+    remembered = st.session_state.model_choice.get(provider)
     model_name = st.selectbox(
         "Model Name",
-        model_options,
-        index=0
+        presets,
+        index=presets.index(remembered) if remembered in presets else 0,
+        key=f"model_name_{provider}",
+        on_change=remember_model_choice,
+        args=(provider,)
     )
 
-    st.divider()
+    # How much of the conversation is forwarded with each message
+    history_mode = st.radio(
+        "Chat History",
+        ["Recent only", "Full history"],
+        index=0,
+        key="history_mode"
+    )
 
-    st.header("Connection Status")
-    if st.button("Refresh Status"):
-        st.rerun()
+    st.divider()
 
-    is_online = check_backend_health()
-    if is_online:
-        st.success("🟢 Backend Online")
-    else:
-        st.error("🔴 Backend Offline")
+    render_connection_status()
 
     st.divider()
 
@@ -89,36 +193,37 @@ with st.sidebar:
         st.rerun()
 
 # --- Tab Container ---
-# Build tab labels: Orchestrator first, then sub-agents in order of first call
-tab_labels = ["Orchestrator"]
-for name in st.session_state.tab_order:
-    display_name = get_agent_display_name(name)
-    if st.session_state.agent_tabs[name].get("has_new_activity", False):
-        display_name += " 🟢"
-    tab_labels.append(display_name)
-
-tabs = st.tabs(tab_labels)
-
-# --- Orchestrator Tab (Main Chat) ---
-with tabs[0]:
-    # Display Chat History
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
+def get_tab_labels() -> list[str]:
+    """
+    Tab labels: Orchestrator first, then sub-agents in order of first call.
+    Memoized in session_state on (tab order, unread flags), the only inputs.
+    """
+    tab_order = st.session_state.tab_order
+    agent_tabs = st.session_state.agent_tabs
+    key = (tuple(tab_order), tuple(agent_tabs[name]["has_new_activity"] for name in tab_order))
+    if st.session_state.get("_tab_labels_key") != key:
+        labels = ["Orchestrator"]
+        for name, unread in zip(*key):
+            display_name = logic.get_agent_display_name(name)
+            labels.append(f"{display_name} 🟢" if unread else display_name)
+        st.session_state._tab_labels_key = key
+        st.session_state._tab_labels = labels
+    return st.session_state._tab_labels
+
+tabs = st.tabs(get_tab_labels())
 
 # --- Sub-Agent Tabs ---
 for i, agent_name in enumerate(st.session_state.tab_order):
     with tabs[i + 1]:
-        agent_state = st.session_state.agent_tabs.get(agent_name, {})
-        logs = agent_state.get("logs", [])
-        status = agent_state.get("status", "idle")
-        display_name = get_agent_display_name(agent_name)
+        # Records are created with every key (logic._new_agent_record)
+        agent_state = st.session_state.agent_tabs[agent_name]
+        logs = agent_state["logs"]
+        status = agent_state["status"]
+        display_name = logic.get_agent_display_name(agent_name)
 
         # Check for new activity and offer to clear it
-        if agent_state.get("has_new_activity", False):
-            if st.button("Mark Read", key=f"mark_read_{agent_name}"):
-                st.session_state.agent_tabs[agent_name]["has_new_activity"] = False
-                st.rerun()
+        if agent_state["has_new_activity"]:
+            st.button("Mark Read", key=f"mark_read_{agent_name}", on_click=mark_agent_read, args=(agent_name,))
 
         # Show status indicator
         if status == "running":
@@ -137,25 +242,8 @@ for i, agent_name in enumerate(st.session_state.tab_order):
 
         # Display logs
         if logs:
-            logs_html = ""
-            for log in logs:
-                # Handle legacy string logs if any (defensive)
-                if isinstance(log, str):
-                    logs_html += f'<div class="log-entry">{log}</div>'
-                else:
-                    # Map status to CSS class
-                    status_slug = log.get('status', 'thought').lower()
-                    status_class = f"log-type-{status_slug}"
-
-                    timestamp_html = f'<span class="log-timestamp">{log["timestamp"]}</span>' if log.get("timestamp") else ''
-
-                    logs_html += f"""
-                    <div class="log-entry {status_class}">
-                        {timestamp_html}
-                        <span class="log-icon">{log["icon"]}</span>
-                        <span class="log-message">{log["message"]}</span>
-                    </div>
-                    """
+            # Entry HTML is rendered once when the log is appended
+            logs_html = "".join(logic.render_log_entry(log) for log in logs)
 
             st.markdown(f"""
             <div class="agent-log-wrapper">
@@ -168,93 +256,187 @@ for i, agent_name in enumerate(st.session_state.tab_order):
         else:
             st.caption("No activity yet.")
 
-# --- Chat Input & Streaming Logic ---
-if prompt := st.chat_input("How can I help you troubleshoot?"):
+# --- Chat History, Input & Streaming Logic ---
+def render_chat_history() -> None:
+    """
+    Displays the conversation so far. Each message sits in a container keyed
+    by its id, so Streamlit matches it across reruns by identity, not position.
+    """
+    messages = st.session_state.messages
+    older_count = len(messages) - CHAT_RENDER_WINDOW
+    if older_count > 0:
+        # Older turns are only drawn on request, keeping each rerun's work bounded
+        if not st.toggle(f"Show older ({older_count})", key="show_older_messages"):
+            messages = messages[older_count:]
+
+    for message in messages:
+        with st.container(key=f"message_{message['id']}"):
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
+
+def handle_user_input(prompt: str) -> None:
+    """Sends the prompt to the backend and streams the reply into the chat."""
+    # Sidebar settings are read from session_state: during a fragment rerun
+    # the sidebar code does not run again
+    provider = st.session_state.model_provider
+    model_name = st.session_state[f"model_name_{provider}"]
+    history_mode = st.session_state.history_mode
+
     # 1. Display User Message
     with st.chat_message("user"):
         st.markdown(prompt)
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    logic.append_message(st.session_state, "user", prompt)
 
     # 2. Prepare for Assistant Response
     with st.chat_message("assistant"):
-        message_placeholder = st.empty()
+        # Streamed text is appended as new elements holding only the text
+        # received since the last render, so each update sends the delta
+        # rather than re-sending everything shown so far
+        message_area = st.container()
 
         # We'll use an expander for "Thoughts" that updates in real-time
         thought_expander = st.status("Thinking...", expanded=True)
-        thought_text = ""
-
-        full_response = ""
+        # Pending (not yet rendered) text; emptied on every render
+        thought_pending = io.StringIO()
+        response_pending = io.StringIO()
+        # The complete response, kept for the chat history
+        response_buf = io.StringIO()
 
         try:
-            # 3. Call Backend API with Streaming
-            payload = {
-                "message": prompt,
-                "model_provider": provider.lower(),  # Backend expects lowercase
-                "model_name": model_name
-            }
-
-            response = requests.post(
-                API_CHAT_URL,
-                json=payload,
-                stream=True
+            # 3. Call Backend API with Streaming (network + parsing on a worker thread)
+            # Prior turns only: the new prompt was already appended to messages
+            prior_messages = st.session_state.messages[:-1]
+            if history_mode == "Recent only":
+                history = logic.recent_context(prior_messages)
+            else:
+                history = logic.full_context(prior_messages)
+
+            body = logic.build_chat_payload(
+                prompt,
+                provider.lower(),  # Backend expects lowercase
+                model_name,
+                history
             )
 
-            if response.status_code == 200:
-                # 4. Process SSE Stream
-                for line in response.iter_lines():
-                    if line:
-                        decoded_line = line.decode('utf-8')
-
-                        if decoded_line.startswith("event:"):
-                            event_type = decoded_line.split(":", 1)[1].strip()
-                        elif decoded_line.startswith("data:"):
-                            data_str = decoded_line.split(":", 1)[1].strip()
-
-                            try:
-                                data = json.loads(data_str)
-
-                                if event_type == "thought":
-                                    # Handle thought event via logic module
-                                    delta = logic.handle_thought_event(data, st.session_state)
-                                    if delta:
-                                        thought_text += delta
-                                        thought_expander.markdown(thought_text)
-
-                                    # Check if we need to rerun (new tab created)
-                                    if st.session_state.get("new_tab_created", False):
-                                        # We defer the rerun until the end of the loop or handle it immediately?
-                                        # In the previous code it set a flag.
-                                        # logic.handle_thought_event sets st.session_state["new_tab_created"] = True
-                                        pass
-
-                                elif event_type == "routing":
-                                    # Handle routing event
-                                    delta = logic.handle_routing_event(data)
-                                    thought_text += delta
-                                    thought_expander.markdown(thought_text)
-
-                                elif event_type == "triage_report":
-                                    # Handle Triage Report
-                                    delta = logic.handle_triage_report(data)
-                                    full_response += delta
-                                    message_placeholder.markdown(full_response)
-
-                            except json.JSONDecodeError:
-                                pass # formatting error or keepalive
-            else:
-                st.error(f"Error: {response.status_code} - {response.text}")
+            events: queue.SimpleQueue = queue.SimpleQueue()
+            threading.Thread(
+                target=stream_chat_events,
+                args=(get_backend_session(), body, events),
+                daemon=True
+            ).start()
+
+            # 4. Process SSE Stream
+            stream_open = True
+            agents_updated = False
+            new_tab_created = False
+            thought_dirty = False
+            response_dirty = False
+            pending_chars = 0
+            last_render = time.monotonic()
+            while stream_open:
+                # Block for the next event (or until a pending update is due),
+                # then drain whatever else is already queued
+                timeout = None
+                if pending_chars:
+                    timeout = max(0.0, RENDER_INTERVAL - (time.monotonic() - last_render))
+                try:
+                    batch = [events.get(timeout=timeout)]
+                except queue.Empty:
+                    batch = []
+                while True:
+                    try:
+                        batch.append(events.get_nowait())
+                    except queue.Empty:
+                        break
+
+                for item in batch:
+                    if item is STREAM_END:
+                        stream_open = False
+                        break
+
+                    event_type, data = item
+                    if event_type == "thought":
+                        # Handle thought event via logic module
+                        delta, tab_created = logic.handle_thought_event(
+                            data, st.session_state.agent_tabs, st.session_state.tab_order
+                        )
+                        new_tab_created = new_tab_created or tab_created
+                        if data.get("node") in st.session_state.agent_tabs:
+                            agents_updated = True
+                        if delta:
+                            thought_pending.write(delta)
+                            thought_dirty = True
+                            pending_chars += len(delta)
+
+                        # The rerun that shows a new tab is deferred until the stream ends
+
+                    elif event_type == "routing":
+                        # Handle routing event
+                        delta = logic.handle_routing_event(data)
+                        thought_pending.write(delta)
+                        thought_dirty = True
+                        pending_chars += len(delta)
+
+                    elif event_type == "triage_report":
+                        # Handle Triage Report
+                        delta = logic.handle_triage_report(data)
+                        response_buf.write(delta)
+                        response_pending.write(delta)
+                        response_dirty = True
+                        pending_chars += len(delta)
+
+                    elif event_type == "error":
+                        st.error(data)
+
+                # Coalesce updates: re-render at most every RENDER_INTERVAL seconds
+                now = time.monotonic()
+                if pending_chars and (
+                    pending_chars >= RENDER_MAX_PENDING_CHARS or now - last_render >= RENDER_INTERVAL
+                ):
+                    if thought_dirty:
+                        thought_expander.markdown(logic.take_text(thought_pending))
+                    if response_dirty:
+                        message_area.markdown(logic.take_text(response_pending))
+                    thought_dirty = response_dirty = False
+                    pending_chars = 0
+                    last_render = now
+
+            # Final render so nothing buffered is lost; clean (already shown or
+            # empty) text is not re-sent to the browser
+            if thought_dirty:
+                thought_expander.markdown(logic.take_text(thought_pending))
 
             thought_expander.update(label="Finished Processing", state="complete", expanded=False)
-            message_placeholder.markdown(full_response)
+            if response_dirty:
+                message_area.markdown(logic.take_text(response_pending))
+
+            full_response = response_buf.getvalue()
+            # Release the buffers before the final string is stored in session state
+            del thought_pending, response_pending, response_buf
 
             # 5. Save valid response to history
             if full_response:
-                st.session_state.messages.append({"role": "assistant", "content": full_response})
+                logic.append_message(st.session_state, "assistant", full_response)
+                logic.archive_old_messages(st.session_state.messages)
 
-            # Force a rerun if a new tab was created so it appears in the UI
-            if st.session_state.get("new_tab_created", False):
-                st.session_state.new_tab_created = False
+            # Sub-agent tabs live outside the chat fragment: rerun the whole app
+            # so new tabs and fresh activity logs appear in the UI
+            if new_tab_created or agents_updated:
                 st.rerun()
 
         except Exception as e:
             st.error(f"Connection failed: {e}")
+
+@st.fragment
+def chat_fragment() -> None:
+    """
+    Chat history and input. Runs as a fragment so submitting a message only
+    reruns the chat area instead of the whole page.
+    """
+    render_chat_history()
+    if prompt := st.chat_input("How can I help you troubleshoot?"):
+        handle_user_input(prompt)
+
+# --- Orchestrator Tab (Main Chat) ---
+with tabs[0]:
+    chat_fragment()
@@ -1,6 +1,27 @@
+import io
 import json
+import os
+from collections import deque
 from datetime import datetime
-from typing import Dict, Any, List
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, Any, Deque, Iterator, List, Mapping, Optional, Tuple, Union
+
+try:
+    import orjson
+
+    # orjson parses bytes directly and is several times faster than json
+    def json_loads(data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+
+    def json_dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:  # Optional dependency; the stdlib parser also accepts bytes
+    def json_loads(data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+    def json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
 
 # Display name mapping for sub-agent tabs (raw node name -> display label)
 AGENT_DISPLAY_NAMES: dict[str, str] = {
@@ -10,11 +31,74 @@ AGENT_DISPLAY_NAMES: dict[str, str] = {
     "triage": "Triage",
 }
 
+# Icon shown per thought status; anything else (e.g. plain messages) gets DEFAULT_STATUS_ICON
+STATUS_ICONS: dict[str, str] = {
+    "chain_start": "🔄",
+    "tool_start": "🔧",
+    "chain_end": "✅",
+}
+DEFAULT_STATUS_ICON = "💭"
+
+# Markdown for a triage_report event; filled by handle_triage_report
+TRIAGE_REPORT_TEMPLATE = (
+    "\n### 🚨 Triage Report\n"
+    "**Root Cause:** {root_cause}\n\n"
+    "**Action:** {action}\n\n"
+    "**Details:** {details}\n"
+)
+
+# Activity-log HTML for one sub-agent log entry; filled by render_log_entry
+LOG_ENTRY_TEMPLATE = (
+    '<div class="log-entry {status_class}">'
+    '{timestamp_html}'
+    '<span class="log-icon">{icon}</span>'
+    '<span class="log-message">{message}</span>'
+    '</div>'
+)
+LOG_TIMESTAMP_TEMPLATE = '<span class="log-timestamp">{}</span>'
+# Bound once so rendering an entry skips the attribute lookups
+_format_log_entry = LOG_ENTRY_TEMPLATE.format
+_format_log_timestamp = LOG_TIMESTAMP_TEMPLATE.format
+
+# Activity-log entries kept per sub-agent; older entries are dropped first
+AGENT_LOG_CAP = int(os.getenv("AGENT_LOG_CAP", "200"))
+
+# Selectable models per provider (sidebar label -> model names, default first).
+# Frozen at import time; the sidebar reads these on every rerun.
+MODEL_PRESETS: Mapping[str, Tuple[str, ...]] = MappingProxyType({
+    "OpenAI": ("gpt-4o", "gpt-4-turbo", "gpt-3.5-turbo"),
+    "Gemini": ("gemini-2.5-flash",),
+})
+PROVIDER_OPTIONS: Tuple[str, ...] = tuple(MODEL_PRESETS)
+PROVIDER_INDEX: Mapping[str, int] = MappingProxyType(
+    {provider: i for i, provider in enumerate(PROVIDER_OPTIONS)}
+)
+DEFAULT_PROVIDER = "Gemini"
+
+# SSE field prefixes, matched against raw bytes so only payloads get decoded
+_EVENT = b"event:"
+_DATA = b"data:"
+_FIELDS = (_DATA, _EVENT)
+_DATA_INITIAL = _DATA[0]
+
+# Heartbeat events carry no content: dropped by the parser before any decoding
+KEEPALIVE_EVENTS = frozenset({"ping", "keepalive"})
+
+# Known event names as bytes -> str, so they are looked up instead of decoded per event
+_EVENT_NAMES: dict[bytes, str] = {
+    name.encode(): name
+    for name in ("message", "thought", "routing", "triage_report", "error", *KEEPALIVE_EVENTS)
+}
+
 def initialize_session_state(state: Dict[str, Any]) -> None:
     """Initializes the session state with default values."""
     if "messages" not in state:
         state["messages"] = []
 
+    # Source of stable per-message ids (never reset, even when history is cleared)
+    if "next_message_id" not in state:
+        state["next_message_id"] = 0
+
     # Tab state for sub-agents: {agent_name: {created: bool, logs: list, status: str, has_new_activity: bool}}
     if "agent_tabs" not in state:
         state["agent_tabs"] = {}
@@ -23,8 +107,43 @@ def initialize_session_state(state: Dict[str, Any]) -> None:
     if "tab_order" not in state:
         state["tab_order"] = []
 
+    # Last model picked per provider: {provider: model_name}. Plain state, not a
+    # widget key, because Streamlit drops the state of widgets that aren't rendered
+    if "model_choice" not in state:
+        state["model_choice"] = {}
+
+def append_message(state: Dict[str, Any], role: str, content: str) -> Dict[str, Any]:
+    """Appends a chat message tagged with a stable, increasing id and returns it."""
+    message_id = state["next_message_id"]
+    state["next_message_id"] = message_id + 1
+    message = {"id": message_id, "role": role, "content": content}
+    state["messages"].append(message)
+    return message
+
+def archive_old_messages(messages: List[Dict[str, Any]], max_chars: int = 200_000) -> int:
+    """
+    Replaces the oldest message bodies with "[archived: N chars]" markers
+    until the total content size fits within max_chars. The newest message
+    is always kept intact. Returns the number of messages archived.
+    """
+    total = sum(len(m["content"]) for m in messages)
+    archived = 0
+    for message in messages[:-1]:
+        if total <= max_chars:
+            break
+        if message.get("archived"):
+            continue
+        size = len(message["content"])
+        marker = f"[archived: {size} chars]"
+        message["content"] = marker
+        message["archived"] = True
+        total -= size - len(marker)
+        archived += 1
+    return archived
+
+@lru_cache(maxsize=64)
 def get_agent_display_name(node_name: str) -> str:
-    """Convert raw node name to properly formatted display label."""
+    """Convert raw node name to properly formatted display label (memoized; the node set is small)."""
     return AGENT_DISPLAY_NAMES.get(node_name.lower(), node_name.title())
 
 def process_event(data: Dict[str, Any], state: Dict[str, Any]) -> Dict[str, Any]:
@@ -55,10 +174,68 @@ def process_event(data: Dict[str, Any], state: Dict[str, Any]) -> Dict[str, Any]
     pass # Implementation details below in the actual write
     return ui_updates
 
+@lru_cache(maxsize=16)
+def _chat_payload_prefix(model_provider: str, model_name: str) -> bytes:
+    # Static part of the request body: only changes with the sidebar settings
+    return (
+        b'{"model_provider":' + json_dumps(model_provider)
+        + b',"model_name":' + json_dumps(model_name)
+        + b',"message":'
+    )
+
+def build_chat_payload(message: str, model_provider: str, model_name: str, history: List[Dict[str, str]]) -> bytes:
+    """
+    Serializes a /chat request body to JSON bytes. The provider/model prefix
+    is serialized once per combination; only the message and history are
+    encoded per request.
+    """
+    return (
+        _chat_payload_prefix(model_provider, model_name)
+        + json_dumps(message)
+        + b',"history":' + json_dumps(history)
+        + b"}"
+    )
+
+def take_text(buf: io.StringIO) -> str:
+    """Returns the buffered text and empties the buffer for reuse."""
+    text = buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    return text
+
+def recent_context(messages: List[Dict[str, Any]], k: int = 8, max_chars: int = 4000) -> List[Dict[str, str]]:
+    """
+    Returns the last `k` chat messages to forward to the backend, capped at
+    `max_chars` of content in total. The newest messages are kept; the oldest
+    kept message is truncated if it crosses the budget. Archived messages are
+    skipped: their content is only an "[archived: N chars]" marker.
+    """
+    context: List[Dict[str, str]] = []
+    budget = max_chars
+    for message in reversed(messages[-k:] if k > 0 else []):
+        if budget <= 0:
+            break
+        if message.get("archived"):
+            continue
+        content = message["content"][:budget]
+        budget -= len(content)
+        context.append({"role": message["role"], "content": content})
+
+    context.reverse()
+    return context
+
+def full_context(messages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Returns every chat message to forward to the backend, skipping archived ones."""
+    return [{"role": m["role"], "content": m["content"]} for m in messages if not m.get("archived")]
+
 def format_timestamp(timestamp_str: str) -> str:
     """Formats an ISO timestamp string to HH:MM:SS."""
     if not timestamp_str:
         return ""
+    # Fast path for the backend's ISO timestamps (YYYY-MM-DDTHH:MM:SS...):
+    # the wall-clock time is already characters 11-19
+    if len(timestamp_str) >= 19 and timestamp_str[10] == "T" and timestamp_str[13] == timestamp_str[16] == ":":
+        return timestamp_str[11:19]
     try:
         # Handle ISO format with potential Z or offset
         dt = datetime.fromisoformat(timestamp_str.replace("Z", "+00:00"))
@@ -66,49 +243,86 @@ def format_timestamp(timestamp_str: str) -> str:
     except ValueError:
         return ""
 
-def handle_thought_event(data: Dict[str, Any], state: Dict[str, Any]) -> str:
+def render_log_entry(log: Union[str, Dict[str, Any]]) -> str:
+    """
+    Returns the activity-log HTML for one sub-agent log entry.
+    The result is cached on dict entries under "html".
+    """
+    if isinstance(log, str):  # legacy string logs (defensive)
+        return f'<div class="log-entry">{log}</div>'
+
+    html = log.get("html")
+    if html is None:
+        # CSS classes use dashes: chain_start -> log-type-chain-start
+        status_class = "log-type-" + (log.get("status") or "thought").lower().replace("_", "-")
+        timestamp = log.get("timestamp")
+        html = _format_log_entry(
+            status_class=status_class,
+            timestamp_html=_format_log_timestamp(timestamp) if timestamp else "",
+            icon=log["icon"],
+            message=log["message"],
+        )
+        log["html"] = html
+    return html
+
+def _new_agent_record() -> Dict[str, Any]:
+    """A sub-agent tab record with every key the UI reads, so it can index directly."""
+    return {
+        "created": True,
+        # Bounded, so tab renders and memory stay O(AGENT_LOG_CAP)
+        "logs": deque(maxlen=AGENT_LOG_CAP),
+        "status": "running",
+        "has_new_activity": True
+    }
+
+def handle_thought_event(
+    data: Mapping[str, Any],
+    agent_tabs: Dict[str, Dict[str, Any]],
+    tab_order: List[str]
+) -> Tuple[str, bool]:
     """
-    Handles a 'thought' event.
-    Updates agent_tabs in state.
-    Returns the markdown text delta to be added to the thought expander.
+    Handles a 'thought' event. Payload keys (all optional): node, status,
+    message, timestamp.
+    Updates agent_tabs / tab_order in place; takes only these two fields, not
+    the whole session state, so no caching layer ever has to hash the state.
+    Returns (markdown delta for the thought expander, whether a new tab was created).
     """
     node = data.get("node", "Unknown")
     status = data.get("status", "")
     message = data.get("message", "")
     timestamp_str = data.get("timestamp", "")
 
+    # At most one line is emitted per event: assigned, never concatenated
     thought_text_delta = ""
+    new_tab_created = False
 
     # Check if this is a sub-agent (not orchestrator)
     is_subagent = node.lower() != "orchestrator" and node != "Unknown"
 
     if is_subagent:
         # Create tab for new sub-agent on first call
-        if node not in state["agent_tabs"]:
-            state["agent_tabs"][node] = {
-                "created": True,
-                "logs": [],
-                "status": "running",
-                "has_new_activity": True
-            }
+        if node not in agent_tabs:
+            agent_tabs[node] = _new_agent_record()
             # Prevent duplicate entries in tab_order
-            if node not in state["tab_order"]:
-                state["tab_order"].append(node)
-                state["new_tab_created"] = True # handled by caller to trigger rerun
+            if node not in tab_order:
+                tab_order.append(node)
+                new_tab_created = True # handled by caller to trigger rerun
+
+        agent = agent_tabs[node]
 
         # Update sub-agent status
         display_name = get_agent_display_name(node)
 
         if status == "chain_start":
-            state["agent_tabs"][node]["status"] = "running"
-            thought_text_delta += f"🔄 **CALLING SUB-AGENT: {display_name}**\n\n"
+            agent["status"] = "running"
+            thought_text_delta = f"🔄 **CALLING SUB-AGENT: {display_name}**\n\n"
         elif status == "chain_end":
-            state["agent_tabs"][node]["status"] = "complete"
-            thought_text_delta += f"✅ **{display_name} Complete**\n\n"
+            agent["status"] = "complete"
+            thought_text_delta = f"✅ **{display_name} Complete**\n\n"
 
         # Route event to sub-agent's log
         formatted_time = format_timestamp(timestamp_str)
-        status_icon = "🔄" if status == "chain_start" else "🔧" if status == "tool_start" else "✅" if status == "chain_end" else "💭"
+        status_icon = STATUS_ICONS.get(status, DEFAULT_STATUS_ICON)
 
         log_entry_data = {
             "timestamp": formatted_time,
@@ -117,30 +331,115 @@ def handle_thought_event(data: Dict[str, Any], state: Dict[str, Any]) -> str:
             "message": message
         }
 
-        state["agent_tabs"][node]["logs"].append(log_entry_data)
-        state["agent_tabs"][node]["has_new_activity"] = True
+        # Pre-render the entry's HTML once so tab reruns only join strings
+        render_log_entry(log_entry_data)
+        agent["logs"].append(log_entry_data)
+        agent["has_new_activity"] = True
 
     else:
         # Orchestrator events go to the thinking expander
-        status_icon = "🔄" if status == "chain_start" else "🔧" if status == "tool_start" else "✅" if status == "chain_end" else "💭"
-        thought_text_delta += f"{status_icon} **[{node}]**: {message}\n\n"
+        status_icon = STATUS_ICONS.get(status, DEFAULT_STATUS_ICON)
+        thought_text_delta = f"{status_icon} **[{node}]**: {message}\n\n"
 
-    return thought_text_delta
+    return thought_text_delta, new_tab_created
+
+class SSEParser:
+    """
+    Incremental parser for a Server-Sent Events byte stream.
 
-def handle_routing_event(data: Dict[str, Any]) -> str:
+    Incoming chunks are held in a deque until an event boundary (blank line)
+    arrives; only the chunks that make up a completed event are joined, so
+    the buffered stream is never copied as a whole.
+
+    Follows the SSE spec for line endings (LF, CRLF or lone CR) and strips
+    exactly one leading space from field values.
+
+    Events are yielded as fresh (event_type, data) tuples rather than a shared,
+    mutated object: they cross a thread queue and may be consumed after the
+    parser has moved on to the next event.
+    """
+
+    __slots__ = ("_chunks", "_data_lines", "_pending_cr")
+
+    def __init__(self) -> None:
+        self._chunks: Deque[bytes] = deque()
+        # Scratch list for the current event's data lines, reset in place
+        self._data_lines: List[bytes] = []
+        # Previous chunk ended in "\r": a leading "\n" here completes that CRLF
+        self._pending_cr = False
+
+    def feed(self, chunk: bytes) -> Iterator[Tuple[str, bytes]]:
+        """
+        Consumes a chunk and yields (event_type, data) for each completed event.
+        The data payload is returned as raw bytes; json.loads accepts it as-is.
+        """
+        if self._pending_cr:
+            self._pending_cr = False
+            if chunk[:1] == b"\n":
+                chunk = chunk[1:]
+        if not chunk:
+            return
+
+        # Normalize CRLF / CR to LF; LF-only streams skip this after one scan
+        if b"\r" in chunk:
+            self._pending_cr = chunk[-1:] == b"\r"
+            chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+        # A boundary can straddle chunks: previous tail "\n" + new head "\n"
+        if chunk[:1] == b"\n" and self._chunks and self._chunks[-1][-1:] == b"\n":
+            event = self._dispatch(b"".join(self._chunks)[:-1])
+            if event is not None:
+                yield event
+            self._chunks.clear()
+            chunk = chunk[1:]
+
+        # Otherwise only the newest chunk can contain a new boundary
+        start = 0
+        while (i := chunk.find(b"\n\n", start)) != -1:
+            self._chunks.append(chunk[start:i])
+            event = self._dispatch(b"".join(self._chunks))
+            if event is not None:
+                yield event
+            self._chunks.clear()
+            start = i + 2
+
+        if start < len(chunk):
+            self._chunks.append(chunk[start:])
+
+    def _dispatch(self, record: bytes) -> Optional[Tuple[str, bytes]]:
+        # A plain return (not a nested generator) keeps it to one generator
+        # resume per event between the socket read and the queue
+        event_type = "message"
+        data_lines = self._data_lines
+        data_lines.clear()
+
+        for line in record.split(b"\n"):
+            # One tuple check skips comments and unused fields (id:, retry:);
+            # the first byte then tells data: and event: apart
+            if not line.startswith(_FIELDS):
+                continue
+            if line[0] == _DATA_INITIAL:
+                value = line[5:]
+                data_lines.append(value[1:] if value[:1] == b" " else value)
+            else:
+                value = line[6:]
+                if value[:1] == b" ":
+                    value = value[1:]
+                event_type = _EVENT_NAMES.get(value) or value.decode("utf-8")
+
+        if data_lines and event_type not in KEEPALIVE_EVENTS:
+            return event_type, b"\n".join(data_lines)
+        return None
+
+def handle_routing_event(data: Mapping[str, Any]) -> str:
+    """Handles a 'routing' event. Payload key (optional): routing."""
     next_node = data.get("routing", "")
     return f"*Routing to: `{next_node}`*\n\n"
 
-def handle_triage_report(data: Dict[str, Any]) -> str:
+def handle_triage_report(data: Mapping[str, Any]) -> str:
+    """Handles a 'triage_report' event. Payload keys (all optional): root_cause, action, details."""
     root_cause = data.get("root_cause", "Unknown")
     action = data.get("action", "No action specified")
     details = data.get("details", "")
 
-    return f"""
-### 🚨 Triage Report
-**Root Cause:** {root_cause}
-
-**Action:** {action}
-
-**Details:** {details}
-"""
+    return TRIAGE_REPORT_TEMPLATE.format(root_cause=root_cause, action=action, details=details)
@@ -1,3 +1,5 @@
+import io
+import json
 import pytest
 import sys
 import os
@@ -6,7 +8,7 @@ from typing import Dict, Any, List
 # Ensure backend/frontend modules can be imported
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
-from frontend.logic import initialize_session_state, get_agent_display_name, handle_thought_event, handle_routing_event, handle_triage_report
+from frontend.logic import initialize_session_state, append_message, get_agent_display_name, handle_thought_event, handle_routing_event, handle_triage_report, SSEParser, recent_context, full_context, build_chat_payload, archive_old_messages, take_text, format_timestamp, AGENT_LOG_CAP
 
 def test_initialize_session_state() -> None:
     state: Dict[str, Any] = {}
@@ -17,12 +19,50 @@ def test_initialize_session_state() -> None:
     assert state["agent_tabs"] == {}
     assert "tab_order" in state
     assert state["tab_order"] == []
+    assert state["model_choice"] == {}
+
+    assert state["next_message_id"] == 0
 
     # Should not overwrite existing state
     state["messages"] = ["existing"]
     initialize_session_state(state)
     assert state["messages"] == ["existing"]
 
+def test_append_message_assigns_increasing_ids() -> None:
+    state: Dict[str, Any] = {}
+    initialize_session_state(state)
+
+    first = append_message(state, "user", "hello")
+    second = append_message(state, "assistant", "hi")
+
+    assert state["messages"] == [first, second]
+    assert (first["id"], second["id"]) == (0, 1)
+    assert second == {"id": 1, "role": "assistant", "content": "hi"}
+
+    # Ids keep increasing after the history is cleared
+    state["messages"] = []
+    assert append_message(state, "user", "again")["id"] == 2
+
+def test_archive_old_messages_replaces_oldest_bodies() -> None:
+    messages = [
+        {"role": "user", "content": "a" * 60},
+        {"role": "assistant", "content": "b" * 60},
+        {"role": "user", "content": "c" * 60},
+    ]
+
+    assert archive_old_messages(messages, max_chars=150) == 1
+    assert messages[0] == {"role": "user", "content": "[archived: 60 chars]", "archived": True}
+    assert messages[1]["content"] == "b" * 60
+
+    # Already within budget: nothing else is touched
+    assert archive_old_messages(messages, max_chars=150) == 0
+
+def test_archive_old_messages_keeps_newest_message() -> None:
+    messages = [{"role": "assistant", "content": "x" * 500}]
+
+    assert archive_old_messages(messages, max_chars=100) == 0
+    assert messages[0]["content"] == "x" * 500
+
 def test_get_agent_display_name() -> None:
     assert get_agent_display_name("aci") == "ACI"
     assert get_agent_display_name("infoblox") == "Infoblox"
@@ -30,6 +70,16 @@ def test_get_agent_display_name() -> None:
     assert get_agent_display_name("triage") == "Triage"
     assert get_agent_display_name("unknown_agent") == "Unknown_Agent"
 
+@pytest.mark.parametrize("timestamp, expected", [
+    ("2023-10-27T10:00:05Z", "10:00:05"),                 # fast path, Z suffix
+    ("2023-10-27T10:00:05.123456+00:00", "10:00:05"),     # fast path, backend isoformat()
+    ("2023-10-27 10:00:05", "10:00:05"),                  # space separator: datetime fallback
+    ("not a timestamp", ""),
+    ("", ""),
+])
+def test_format_timestamp(timestamp: str, expected: str) -> None:
+    assert format_timestamp(timestamp) == expected
+
 def test_handle_thought_event_new_tab() -> None:
     state: Dict[str, Any] = {"agent_tabs": {}, "tab_order": []}
     data: Dict[str, Any] = {
@@ -39,13 +89,13 @@ def test_handle_thought_event_new_tab() -> None:
         "timestamp": "2023-10-27T10:00:00Z"
     }
 
-    delta = handle_thought_event(data, state)
+    delta, new_tab = handle_thought_event(data, state["agent_tabs"], state["tab_order"])
 
     assert "aci" in state["agent_tabs"]
     assert state["tab_order"] == ["aci"]
     assert state["agent_tabs"]["aci"]["status"] == "running"
     assert "CALLING SUB-AGENT: ACI" in delta
-    assert state["new_tab_created"] is True
+    assert new_tab is True
 
 def test_handle_thought_event_existing_tab() -> None:
     state: Dict[str, Any] = {
@@ -66,8 +116,9 @@ def test_handle_thought_event_existing_tab() -> None:
         "timestamp": "2023-10-27T10:00:05Z"
     }
 
-    delta = handle_thought_event(data, state)
+    delta, new_tab = handle_thought_event(data, state["agent_tabs"], state["tab_order"])
 
+    assert new_tab is False
     assert len(state["agent_tabs"]["aci"]["logs"]) == 1
     log = state["agent_tabs"]["aci"]["logs"][0]
     assert log["status"] == "tool_start"
@@ -75,6 +126,25 @@ def test_handle_thought_event_existing_tab() -> None:
     assert log["timestamp"] == "10:00:05"
     assert state["agent_tabs"]["aci"]["has_new_activity"] is True
     assert delta == "" # No delta for existing sub-agent logs
+    assert log["html"] == (
+        '<div class="log-entry log-type-tool-start">'
+        '<span class="log-timestamp">10:00:05</span>'
+        '<span class="log-icon">🔧</span>'
+        '<span class="log-message">Running tool</span>'
+        '</div>'
+    )
+
+def test_handle_thought_event_caps_agent_logs() -> None:
+    agent_tabs: Dict[str, Any] = {}
+    tab_order: List[str] = []
+
+    for i in range(AGENT_LOG_CAP + 5):
+        handle_thought_event({"node": "aci", "status": "tool_start", "message": f"step {i}"}, agent_tabs, tab_order)
+
+    logs = agent_tabs["aci"]["logs"]
+    assert len(logs) == AGENT_LOG_CAP
+    assert logs[0]["message"] == "step 5"
+    assert logs[-1]["message"] == f"step {AGENT_LOG_CAP + 4}"
 
 def test_handle_thought_event_orchestrator() -> None:
     state: Dict[str, Any] = {"agent_tabs": {}, "tab_order": []}
@@ -85,8 +155,9 @@ def test_handle_thought_event_orchestrator() -> None:
         "timestamp": "2023-10-27T10:00:00Z"
     }
 
-    delta = handle_thought_event(data, state)
+    delta, new_tab = handle_thought_event(data, state["agent_tabs"], state["tab_order"])
 
+    assert new_tab is False
     assert "Orchestrator" not in state["agent_tabs"]
     assert "Thinking..." in delta
 
@@ -105,3 +176,121 @@ def test_handle_triage_report() -> None:
     assert "Network issue" in delta
     assert "Restart switch" in delta
     assert "Switch 1 is down" in delta
+
+def test_sse_parser_reassembles_split_chunks() -> None:
+    payload = (
+        'event: thought\ndata: {"message": "Vérifié"}\n\n'
+        'event: routing\ndata: {"routing": "aci"}\n\n'
+    ).encode("utf-8")
+    # Split in the middle of a line, inside the multi-byte "é" and between
+    # the two newlines of the first event boundary
+    split_at = payload.index("é".encode("utf-8")) + 1
+    boundary = payload.index(b"\n\n") + 1
+    chunks = [payload[:20], payload[20:split_at], payload[split_at:boundary], payload[boundary:]]
+
+    parser = SSEParser()
+    events = [event for chunk in chunks for event in parser.feed(chunk)]
+
+    assert events == [
+        ("thought", '{"message": "Vérifié"}'.encode("utf-8")),
+        ("routing", b'{"routing": "aci"}'),
+    ]
+
+def test_sse_parser_holds_incomplete_event() -> None:
+    parser = SSEParser()
+
+    assert list(parser.feed(b'event: thought\ndata: {"a": 1}\n')) == []
+    assert list(parser.feed(b'\n')) == [("thought", b'{"a": 1}')]
+
+def test_sse_parser_ignores_comments_and_unknown_fields() -> None:
+    parser = SSEParser()
+    stream = b': keepalive\nid: 7\nretry: 1000\nevent: routing\ndata: {"routing": "aci"}\n\n'
+
+    assert list(parser.feed(stream)) == [("routing", b'{"routing": "aci"}')]
+
+def test_sse_parser_handles_crlf_line_endings() -> None:
+    parser = SSEParser()
+    stream = b'event: thought\r\ndata: {"a": 1}\r\n\r\nevent: routing\rdata: {"b": 2}\r\r'
+    # Split inside the first CRLF of the event boundary
+    cut = stream.index(b"\r\n\r\n") + 1
+
+    events = list(parser.feed(stream[:cut])) + list(parser.feed(stream[cut:]))
+
+    assert events == [("thought", b'{"a": 1}'), ("routing", b'{"b": 2}')]
+
+def test_sse_parser_strips_only_one_leading_space() -> None:
+    parser = SSEParser()
+    stream = b'data:no-space\ndata:  indented \n\n'
+
+    assert list(parser.feed(stream)) == [("message", b'no-space\n indented ')]
+
+def test_sse_parser_keeps_colons_in_data() -> None:
+    parser = SSEParser()
+    stream = b'event: thought\ndata: {"message": "GET http://10.0.0.1:8080/api"}\n\n'
+
+    assert list(parser.feed(stream)) == [("thought", b'{"message": "GET http://10.0.0.1:8080/api"}')]
+
+def test_sse_parser_drops_keepalive_events() -> None:
+    parser = SSEParser()
+    stream = b'event: ping\ndata: {}\n\nevent: keepalive\ndata: {}\n\nevent: thought\ndata: {"a": 1}\n\n'
+
+    assert list(parser.feed(stream)) == [("thought", b'{"a": 1}')]
+
+def test_build_chat_payload_round_trips() -> None:
+    history = [{"role": "user", "content": "Earlier \"question\" é"}]
+    first = build_chat_payload("Check 10.0.0.1", "gemini", "gemini-2.5-flash", history)
+    second = build_chat_payload("Next", "gemini", "gemini-2.5-flash", [])
+
+    assert json.loads(first) == {
+        "model_provider": "gemini",
+        "model_name": "gemini-2.5-flash",
+        "message": "Check 10.0.0.1",
+        "history": history,
+    }
+    assert json.loads(second)["message"] == "Next"
+    assert json.loads(second)["history"] == []
+
+def test_take_text_returns_and_resets_buffer() -> None:
+    buf = io.StringIO()
+    buf.write("first ")
+    buf.write("batch")
+
+    assert take_text(buf) == "first batch"
+    buf.write("next")
+    assert take_text(buf) == "next"
+    assert take_text(buf) == ""
+
+def test_recent_context_keeps_last_k_messages() -> None:
+    messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"m{i}"} for i in range(10)]
+
+    context = recent_context(messages, k=3)
+
+    assert [m["content"] for m in context] == ["m7", "m8", "m9"]
+
+def test_recent_context_respects_char_budget() -> None:
+    messages = [
+        {"role": "user", "content": "a" * 10},
+        {"role": "assistant", "content": "b" * 10},
+        {"role": "user", "content": "c" * 10},
+    ]
+
+    context = recent_context(messages, k=8, max_chars=15)
+
+    # Newest message kept whole, the one before it truncated to the remaining budget
+    assert context == [
+        {"role": "assistant", "content": "b" * 5},
+        {"role": "user", "content": "c" * 10},
+    ]
+
+def test_context_skips_archived_messages() -> None:
+    messages = [
+        {"role": "user", "content": "a" * 60},
+        {"role": "assistant", "content": "b" * 60},
+        {"role": "user", "content": "c" * 60},
+    ]
+    archive_old_messages(messages, max_chars=150)
+
+    # The "[archived: N chars]" marker must never be sent as a real turn
+    expected = [{"role": "assistant", "content": "b" * 60}, {"role": "user", "content": "c" * 60}]
+    assert recent_context(messages) == expected
+    assert full_context(messages) == expected
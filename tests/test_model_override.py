@@ -1,8 +1,10 @@
 
+import inspect
+
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
-from backend.src.main import app, get_config
+from backend.src.main import app, chat, get_config
 from backend.src.config import AppConfig
 
 @pytest.fixture
@@ -69,3 +71,7 @@ def test_chat_override_provider(mock_orch_get_llm, mock_aci_get_llm, client):
 
     assert response.status_code == 200
     mock_orch_get_llm.assert_called_with("gemini", "gemini-pro", temperature=0)
+
+def test_chat_endpoint_is_async():
+    """A sync /chat would block the event loop and serialize all requests."""
+    assert inspect.iscoroutinefunction(chat)